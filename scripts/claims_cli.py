@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line entry point for the claims pipeline.
+
+    python scripts/claims_cli.py ingest|aggregate|fit|poisson|render|trends|events|tiles|export|serve [options]
+
+Paths default to $CLAIMS_DATA_DIR (or ./project_data) instead of the
+hard-coded os.chdir() of the cell scripts. Only argparse/json are imported at
+startup; pandas is imported by the commands that read claims, and
+geopandas, matplotlib and scipy only by the commands that need them.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+
+DEFAULT_DATA_DIR = os.environ.get('CLAIMS_DATA_DIR', 'project_data')
+
+GROUP_COLS = {'county': 'County_FIPS', 'hazard': 'hazard_broad', 'year': 'Year'}
+VALUE_COLS = {'dmg': 'PropertyDmg(ADJ)', 'percap': 'PropertyDmgPerCapita'}
+
+
+def data_path(args, name):
+    return os.path.join(args.data_dir, name)
+
+
+def emit(args, table):
+    # Tables go to stdout as text, or as a list of records with --json.
+    # A plain list of dicts is accepted too, for commands that skip pandas
+    if isinstance(table, list):
+        # Non-finite floats become null, as with DataFrame.to_json
+        records = [{k: None if isinstance(v, float) and not math.isfinite(v) else v
+                    for k, v in r.items()} for r in table]
+    else:
+        records = json.loads(table.to_json(orient='records'))
+    if getattr(args, 'json', False):
+        json.dump(records, sys.stdout)
+        sys.stdout.write('\n')
+    elif isinstance(table, list):
+        columns = list(table[0]) if table else []
+        cells = [[f'{r[c]:g}' if isinstance(r[c], float) else str(r[c]) for c in columns]
+                 for r in table]
+        widths = [max([len(c)] + [len(row[i]) for row in cells]) for i, c in enumerate(columns)]
+        for row in [columns] + cells:
+            print(' '.join(v.rjust(w) for v, w in zip(row, widths)))
+    else:
+        print(table.to_string(index=False))
+
+
+def read_claims(args):
+    from claims_data import load_claims
+
+    claims = load_claims(args.claims or data_path(args, 'claims_v2.csv'))
+    if getattr(args, 'hazard', None):
+        claims = claims[claims['hazard_broad'].isin(args.hazard)]
+    if getattr(args, 'county', None):
+        claims = claims[claims['County_FIPS'].isin(args.county)]
+    if getattr(args, 'start', None) is not None:
+        claims = claims[claims['Year'] >= args.start]
+    if getattr(args, 'end', None) is not None:
+        claims = claims[claims['Year'] <= args.end]
+    return claims
+
+
+def read_cube(args):
+    # Claims cube of the filtered claims, which needs at least one claim year
+    from claims_data import claims_cube
+
+    claims = read_claims(args)
+    if claims.empty:
+        sys.exit('No claims match the --hazard/--county/--start/--end filters')
+    return claims_cube(claims, value_col=VALUE_COLS[args.value])
+
+
+# %% Subcommands
+
+def cmd_ingest(args):
+    import pandas as pd
+    from claims_data import DMG_COL, HAZARD_COL, clean_sheldus
+
+    raw = pd.read_csv(args.raw or data_path(args, 'SC-claimsA.csv'), index_col=False)
+    exclude = () if args.keep_hugo else ('Hurricane 1989 Hugo',)
+    claims = clean_sheldus(raw, exclude_events=exclude)
+
+    out = args.out or data_path(args, 'claims_v2.csv')
+    claims.to_csv(out, index=False)
+
+    summary = claims.groupby(HAZARD_COL)[DMG_COL].sum()
+    summary = (summary / summary.sum() * 100).rename('percent').reset_index()
+    emit(args, summary)
+
+
+def cmd_aggregate(args):
+    claims = read_claims(args)
+    by = [GROUP_COLS[b] for b in args.by]
+    value = VALUE_COLS[args.value]
+
+    table = claims.groupby(by)[value].sum().reset_index()
+    table = table.sort_values(value, ascending=False)
+    if args.top:
+        table = table.head(args.top)
+    if args.out:
+        table.to_csv(args.out, index=False)
+    emit(args, table)
+
+
+def annual_series(args):
+    # Annual totals per requested grouping, one row per series
+    import pandas as pd
+
+    cube = read_cube(args)
+    values = cube.values
+    hazards, counties = cube.hazards, cube.counties
+
+    # Statewide and/or all-hazard totals unless grouped by them
+    if 'county' not in args.by:
+        values = values.sum(axis=1, keepdims=True)
+        counties = ['all']
+    if 'hazard' not in args.by:
+        values = values.sum(axis=0, keepdims=True)
+        hazards = ['all']
+
+    index = pd.MultiIndex.from_product([hazards, counties], names=['hazard_broad', 'County_FIPS'])
+    return values.reshape(len(index), -1), cube.years, index
+
+
+def cmd_fit(args):
+    import numpy as np
+    import pandas as pd
+    from ri_models import calc_ri_matrix, fit_log_params
+
+    values, years, index = annual_series(args)
+
+    if args.method == 'log':
+        ri = calc_ri_matrix(values, years)
+        params = fit_log_params(ri, np.where(np.isfinite(ri), values, np.nan))
+        columns = ['a', 'b']
+    else:
+        from extreme_values import fit_gev
+
+        params = fit_gev(np.where(values > 0, values, np.nan), n_workers=args.workers)
+        columns = ['mu', 'sigma', 'xi']
+
+    table = pd.DataFrame(params, index=index, columns=columns).reset_index()
+    emit(args, table.dropna())
+
+
+def cmd_poisson(args):
+    # Same table as ri_models.poisson_grid, but with math instead of
+    # numpy/pandas so the command stays quick to start
+    rows = []
+    for threshold in args.thresholds:
+        # Written as a negative power so huge RIs underflow to 0, not overflow
+        try:
+            lam = args.horizon * 10 ** (-(threshold - args.b) / args.a)
+        except OverflowError:
+            lam = math.inf
+        for k in range(1, args.k_max + 1):
+            p = 0.0
+            if 0 < lam < math.inf:
+                p = math.exp(k * math.log(lam) - lam - math.lgamma(k + 1))
+            rows.append({'threshold': float(threshold), 'Lambda': lam, 'k': k, 'P': p})
+    emit(args, rows)
+
+
+def cmd_render(args):
+    import geopandas as gpd
+    import matplotlib
+    if args.out:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    claims = read_claims(args)
+    value = VALUE_COLS[args.value]
+    totals = claims.groupby('County_FIPS')[value].sum()
+
+    counties = gpd.read_file(args.shapefile or data_path(args, 'county_shapefiles/tl_2021_us_county.shp'))
+    counties = counties.query("STATEFP == '45'")
+    counties = counties.merge(totals, left_on='GEOID', right_index=True, how='left')
+
+    fig, ax = plt.subplots(1, 1, figsize=(15, 20))
+    counties.plot(column=value, ax=ax, cmap='Reds', edgecolor='black', legend=True,
+                  legend_kwds={'orientation': 'horizontal', 'label': 'Inflation adjusted dollars ($)'})
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_title(args.title or f'{value} by county', fontsize=24)
+
+    if args.out:
+        fig.savefig(args.out, bbox_inches='tight')
+    else:
+        plt.show()
+
+
+def cmd_trends(args):
+    from rolling_trends import RollingTrends, rolling_frame
+
+    cube = read_cube(args)
+    trends = RollingTrends(cube.values, cube.years, windows=args.windows, threshold=args.threshold)
+    table = rolling_frame(trends, cube)
+    if args.out:
+        table.to_csv(args.out, index=False)
+    emit(args, table)
+
+
+def cmd_events(args):
+    import geopandas as gpd
+    from event_clustering import cluster_events, county_adjacency, event_losses
+
+    counties = gpd.read_file(args.shapefile or data_path(args, 'county_shapefiles/tl_2021_us_county.shp'))
+    adjacency = county_adjacency(counties.query("STATEFP == '45'"))
+
+    claims = read_claims(args)
+    hazard_col = 'Hazard' if args.detailed else 'hazard_broad'
+    event_id = cluster_events(claims, adjacency, window=args.window, hazard_col=hazard_col)
+    if args.out:
+        claims.assign(event_id=event_id).to_csv(args.out, index=False)
+
+    events = event_losses(claims, event_id, value_col=VALUE_COLS[args.value], hazard_col=hazard_col)
+    emit(args, events.head(args.top).reset_index())
+
+
+def cmd_tiles(args):
+    from county_tiles import export_tiles, write_metric
+
+    out_dir = args.out or data_path(args, 'tiles')
+    if args.rebuild or not os.path.exists(os.path.join(out_dir, 'index.json')):
+        import geopandas as gpd
+
+        counties = gpd.read_file(args.shapefile or data_path(args, 'county_shapefiles/tl_2021_us_county.shp'))
+        export_tiles(counties.query("STATEFP == '45'"), out_dir)
+
+    claims = read_claims(args)
+    totals = claims.groupby('County_FIPS')[VALUE_COLS[args.value]].sum()
+    name = args.name or '_'.join(
+        [args.value] + (args.hazard or []) + [str(y) for y in (args.start, args.end) if y is not None]
+    )
+    print(write_metric(totals, out_dir, name.replace('/', '-')))
+
+
+def cmd_export(args):
+    from export_arrow import export_outputs
+
+    claims = read_claims(args)
+    if claims.empty:
+        sys.exit('No claims match the --hazard/--county/--start/--end filters')
+    manifest = export_outputs(claims, args.out or data_path(args, 'outputs'),
+                              poisson_thresholds=args.thresholds, horizon=args.horizon)
+    if args.json:
+        json.dump(manifest, sys.stdout)
+        sys.stdout.write('\n')
+    else:
+        for name, entry in manifest['files'].items():
+            print(f"{entry['path']:<28} {entry.get('rows', entry.get('shape'))}")
+
+
+def cmd_serve(args):
+    from query_service import serve
+
+    serve(args.claims or data_path(args, 'claims_v2.csv'), args.host, args.port, args.cache_size)
+
+
+# %% Argument parsing
+
+def positive_float(text):
+    value = float(text)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f'must be > 0, got {text}')
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='claims', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='directory holding the SHELDUS and shapefile inputs')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_filters(p, json_output=True):
+        p.add_argument('--claims', help='cleaned claims csv (default DATA_DIR/claims_v2.csv)')
+        p.add_argument('--hazard', nargs='+', help='hazard_broad categories to keep')
+        p.add_argument('--county', nargs='+', help='County FIPS codes to keep')
+        p.add_argument('--start', type=int, help='first year')
+        p.add_argument('--end', type=int, help='last year')
+        p.add_argument('--value', choices=VALUE_COLS, default='dmg')
+        if json_output:
+            p.add_argument('--json', action='store_true', help='print JSON records')
+
+    p = sub.add_parser('ingest', help='clean the raw SHELDUS export into claims_v2.csv')
+    p.add_argument('--raw', help='raw SHELDUS csv (default DATA_DIR/SC-claimsA.csv)')
+    p.add_argument('--out', help='output csv (default DATA_DIR/claims_v2.csv)')
+    p.add_argument('--keep-hugo', action='store_true', help="don't drop Hurricane Hugo")
+    p.add_argument('--json', action='store_true', help='print JSON records')
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser('aggregate', help='sum claims by county/hazard/year')
+    add_filters(p)
+    p.add_argument('--by', nargs='+', choices=GROUP_COLS, default=['county'])
+    p.add_argument('--top', type=int, help='only the largest N rows')
+    p.add_argument('--out', help='also write the table to this csv')
+    p.set_defaults(func=cmd_aggregate)
+
+    p = sub.add_parser('fit', help='fit RI models to annual damages')
+    add_filters(p)
+    p.add_argument('--by', nargs='*', choices=['county', 'hazard'], default=['hazard'])
+    p.add_argument('--method', choices=['log', 'gev'], default='log',
+                   help='log_func RI curve (curve_fit.py) or GEV')
+    p.add_argument('--workers', type=int, help='processes for the GEV fits')
+    p.set_defaults(func=cmd_fit)
+
+    p = sub.add_parser('poisson', help='Poisson exceedance probabilities from (a, b)')
+    p.add_argument('--a', type=positive_float, required=True, help='log_func slope, > 0')
+    p.add_argument('--b', type=float, required=True)
+    p.add_argument('--thresholds', type=float, nargs='+', default=[25, 50, 75, 100, 150])
+    p.add_argument('--horizon', type=int, default=100)
+    p.add_argument('--k-max', type=int, default=49)
+    p.add_argument('--json', action='store_true', help='print JSON records')
+    p.set_defaults(func=cmd_poisson)
+
+    p = sub.add_parser('render', help='county choropleth of summed damages')
+    add_filters(p, json_output=False)
+    p.add_argument('--shapefile', help='TIGER county shapefile')
+    p.add_argument('--title')
+    p.add_argument('--out', help='save the figure instead of showing it')
+    p.set_defaults(func=cmd_render)
+
+    p = sub.add_parser('trends', help='rolling totals, means, exceedances and slopes per series')
+    add_filters(p)
+    p.add_argument('--windows', type=int, nargs='+', default=[5, 10, 20])
+    p.add_argument('--threshold', type=float, help='annual damage counted as an exceedance')
+    p.add_argument('--out', help='also write the table to this csv')
+    p.set_defaults(func=cmd_trends)
+
+    p = sub.add_parser('events', help='cluster claims into events by hazard, time and adjacency')
+    add_filters(p)
+    p.add_argument('--shapefile', help='TIGER county shapefile (for county adjacency)')
+    p.add_argument('--window', type=int, default=1, help='months between linked claims')
+    p.add_argument('--detailed', action='store_true', help='use SHELDUS Hazard, not hazard_broad')
+    p.add_argument('--top', type=int, default=20, help='largest N events to print')
+    p.add_argument('--out', help='write the claims with an event_id column to this csv')
+    p.set_defaults(func=cmd_events)
+
+    p = sub.add_parser('tiles', help='simplified county GeoJSON per zoom plus a metric table')
+    add_filters(p, json_output=False)
+    p.add_argument('--shapefile', help='TIGER county shapefile')
+    p.add_argument('--out', help='output directory (default DATA_DIR/tiles)')
+    p.add_argument('--name', help='metric name (default built from the filters)')
+    p.add_argument('--rebuild', action='store_true', help='rewrite the geometries too')
+    p.set_defaults(func=cmd_tiles)
+
+    p = sub.add_parser('export', help='write Arrow/.npy outputs and a manifest')
+    add_filters(p)
+    p.add_argument('--out', help='output directory (default DATA_DIR/outputs)')
+    p.add_argument('--thresholds', type=float, nargs='+', help='also write Poisson grids')
+    p.add_argument('--horizon', type=int, default=100)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('serve', help='run the local HTTP query service')
+    p.add_argument('--claims', help='cleaned claims csv (default DATA_DIR/claims_v2.csv)')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8590)
+    p.add_argument('--cache-size', type=int, default=512, help='max cached query results')
+    p.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
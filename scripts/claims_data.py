@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the cleaned SHELDUS claims (claims_v2.csv from SHELDUS.py).
+
+The claims cube is the dense hazard x county x year array of summed losses
+that the climate, simulation and trend modules line up against.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+DMG_COL = 'PropertyDmg(ADJ)'
+PERCAP_COL = 'PropertyDmgPerCapita'
+COUNTY_COL = 'County_FIPS'
+HAZARD_COL = 'hazard_broad'
+YEAR_COL = 'Year'
+
+# Columns of the raw SHELDUS export we aren't using
+DROP_COLS = [
+    'StateName', 'Fatalities', 'FatalitiesDuration', 'FatalitiesPerCapita',
+    'Glide', 'Injuries', 'InjuriesDuration', 'InjuriesPerCapita', 'PropertyDmgDuration'
+]
+
+HAZARD_CATEGORIES = ['Drought/Heat/Wildfire', 'Hurricane/TropicalStorm', 'GeneralStorm',
+                     'WinterWeather', 'Unclassified']
+
+# Keywords of each broad category, checked in order like hazard_broad_reclass()
+HAZARD_KEYWORDS = [
+    ('Drought/Heat/Wildfire', ['Heat', 'Drought', 'Wildfire']),
+    ('Hurricane/TropicalStorm', ['Hurricane', 'Tropical Storm']),
+    ('GeneralStorm', ['Tornado', 'Severe Storm', 'Thunder Storm', 'Hail', 'Wind',
+                      'Flooding', 'Lightning']),
+    ('WinterWeather', ['Winter Weather']),
+]
+
+ClaimsCube = namedtuple('ClaimsCube', ['values', 'hazards', 'counties', 'years'])
+
+
+def format_fips(fips):
+    # SHELDUS stores FIPS as numbers, the TIGER shapefiles use 5 character GEOIDs
+    return pd.Series(fips).astype(float).astype(int).astype(str).str.zfill(5).values
+
+
+def hazard_broad(hazards):
+    # Vectorized version of hazard_broad_reclass() in SHELDUS.py
+    hazards = pd.Series(hazards).astype(str)
+    conditions = [
+        hazards.str.contains('|'.join(words), regex=True).to_numpy()
+        for _, words in HAZARD_KEYWORDS
+    ]
+    labels = [label for label, _ in HAZARD_KEYWORDS]
+    return np.select(conditions, labels, default='Unclassified')
+
+
+def clean_sheldus(raw, exclude_events=('Hurricane 1989 Hugo',)):
+    # Sections 2.0, 4.1 and 5.0 of SHELDUS.py, raw export -> claims_v2
+    claims = raw.drop(columns=[c for c in DROP_COLS if c in raw.columns])
+    claims = claims.rename(columns={' Hazard': 'Hazard', ' CountyName': 'CountyName'})
+
+    # Landslides are geologic, not climate. Also, not common in SC.
+    claims = claims[claims['Hazard'] != 'Landslide']
+    claims = claims[claims[DMG_COL] > 0]
+    claims = claims[~claims['EventName'].isin(exclude_events)].copy()
+
+    claims[HAZARD_COL] = hazard_broad(claims['Hazard'])
+    claims[COUNTY_COL] = format_fips(claims[COUNTY_COL])
+    return claims.reset_index(drop=True)
+
+
+def load_claims(path):
+    claims = pd.read_csv(path, index_col=False)
+    claims[COUNTY_COL] = format_fips(claims[COUNTY_COL])
+    return claims
+
+
+def claims_cube(claims, value_col=DMG_COL, hazards=None, counties=None, years=None, agg='sum'):
+    # Sum (or agg='max' etc.) the claims into every hazard/county/year cell,
+    # years without claims are 0
+    if hazards is None:
+        hazards = sorted(claims[HAZARD_COL].unique().tolist())
+    if counties is None:
+        counties = sorted(claims[COUNTY_COL].unique().tolist())
+    if years is None:
+        years = np.arange(claims[YEAR_COL].min(), claims[YEAR_COL].max() + 1)
+
+    totals = claims.groupby([HAZARD_COL, COUNTY_COL, YEAR_COL])[value_col].agg(agg)
+    full_index = pd.MultiIndex.from_product(
+        [hazards, counties, years],
+        names=[HAZARD_COL, COUNTY_COL, YEAR_COL]
+    )
+    totals = totals.reindex(full_index, fill_value=0.0)
+
+    values = totals.to_numpy(dtype=float).reshape(len(hazards), len(counties), len(years))
+    return ClaimsCube(values, list(hazards), list(counties), np.asarray(years))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pre-simplified county geometries for web maps, plus per-county metric tables.
+
+The geometries are written once per zoom level. Simplifying each county on
+its own opens gaps and overlaps along shared borders, so the borders are
+first split into arcs between junctions, every arc is simplified once, and
+the counties are rebuilt from the simplified arcs. Neighbours therefore keep
+identical borders at every zoom.
+
+Metrics are written separately as arrays in the feature order of index.json,
+so a map update only ships the numbers.
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+# Web mercator tiles are 256 px, simplify to within half a pixel
+TILE_SIZE = 256
+PIXEL_TOLERANCE = 0.5
+DEFAULT_ZOOMS = (5, 6, 7, 8, 9, 10)
+
+
+def zoom_tolerance(zoom):
+    # Degrees of longitude per pixel at this zoom, times the pixel tolerance
+    return 360 / (TILE_SIZE * 2 ** zoom) * PIXEL_TOLERANCE
+
+
+def zoom_precision(zoom):
+    # Decimal places that still resolve a tenth of the tolerance
+    return max(0, math.ceil(-math.log10(zoom_tolerance(zoom) / 10)))
+
+
+def simplify_shared(counties, tolerance, geoid_col='GEOID'):
+    """
+    Topology preserving simplification of a county GeoDataFrame (lon/lat).
+    Returns a GeoDataFrame with one (multi)polygon per county.
+    """
+    import geopandas as gpd
+    import shapely
+    from shapely.ops import linemerge, polygonize, unary_union
+
+    # Shared borders dissolve into one line, merged into arcs between junctions
+    borders = unary_union(counties.geometry.boundary.tolist())
+    arcs = linemerge(borders)
+    arcs = list(getattr(arcs, 'geoms', [arcs]))
+
+    simplified = shapely.simplify(np.asarray(arcs, dtype=object), tolerance, preserve_topology=False)
+    # Re-node in case simplified arcs cross each other
+    faces = gpd.GeoDataFrame(
+        geometry=list(polygonize(unary_union(simplified.tolist()))), crs=counties.crs
+    )
+
+    # Each face belongs to the county it overlaps most, a representative point
+    # test drops faces whose point lands on a (moved) border
+    counties = counties[[geoid_col, 'geometry']].reset_index(drop=True)
+    pairs = gpd.sjoin(faces, counties, predicate='intersects', how='inner')
+    right = pairs['index_right'].to_numpy()
+    pairs['overlap'] = shapely.area(shapely.intersection(
+        pairs.geometry.values, counties.geometry.values[right]
+    ))
+    pairs = pairs[pairs['overlap'] > 0].sort_values('overlap')
+    owners = pairs[~pairs.index.duplicated(keep='last')]
+    faces = faces.loc[owners.index].assign(**{geoid_col: owners[geoid_col].values})
+    result = faces.dissolve(by=geoid_col).reset_index()
+
+    # Counties that collapsed entirely (tiny islands) fall back to a plain simplify
+    missing = counties[~counties[geoid_col].isin(result[geoid_col])]
+    if len(missing):
+        fallback = missing[[geoid_col, 'geometry']].copy()
+        fallback['geometry'] = fallback.geometry.simplify(tolerance, preserve_topology=True)
+        result = gpd.GeoDataFrame(
+            pd.concat([result, fallback], ignore_index=True), geometry='geometry', crs=counties.crs
+        )
+    return result.sort_values(geoid_col).reset_index(drop=True)
+
+
+def _round_coords(coords, digits):
+    if isinstance(coords[0], (int, float)):
+        return [round(c, digits) for c in coords]
+    return [_round_coords(c, digits) for c in coords]
+
+
+def write_geojson(gdf, path, properties, digits):
+    from shapely.geometry import mapping
+
+    features = []
+    for _, row in gdf.iterrows():
+        geometry = None
+        if row.geometry is not None and not row.geometry.is_empty:
+            geometry = mapping(row.geometry)
+            geometry['coordinates'] = _round_coords(geometry['coordinates'], digits)
+        features.append({
+            'type': 'Feature',
+            'properties': {p: row[p] for p in properties},
+            'geometry': geometry,
+        })
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f, separators=(',', ':'))
+
+
+def export_tiles(counties, out_dir, zooms=DEFAULT_ZOOMS, geoid_col='GEOID', name_col='NAME'):
+    """
+    Write counties_z{zoom}.geojson for every zoom and index.json with the
+    feature (GEOID) order shared by all metric tables.
+    """
+    counties = counties.to_crs('EPSG:4326').sort_values(geoid_col).reset_index(drop=True)
+    os.makedirs(out_dir, exist_ok=True)
+    properties = [geoid_col] + ([name_col] if name_col in counties else [])
+
+    files = {}
+    for zoom in zooms:
+        simple = simplify_shared(counties, zoom_tolerance(zoom), geoid_col=geoid_col)
+        simple = simple.merge(counties[properties], on=geoid_col, how='left')
+        files[str(zoom)] = f'counties_z{zoom}.geojson'
+        write_geojson(simple, os.path.join(out_dir, files[str(zoom)]), properties, zoom_precision(zoom))
+
+    index = {
+        'geoids': counties[geoid_col].tolist(),
+        'names': counties[name_col].tolist() if name_col in counties else None,
+        'zooms': files,
+    }
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def write_metric(values, out_dir, name, significant=4):
+    """
+    Write one per-county metric (a Series indexed by GEOID) as
+    metrics/{name}.json, an array in index.json order with null for
+    counties without a value.
+    """
+    with open(os.path.join(out_dir, 'index.json')) as f:
+        geoids = json.load(f)['geoids']
+
+    aligned = values.reindex(geoids)
+    out = [
+        None if not np.isfinite(v) else float(f'{v:.{significant}g}')
+        for v in aligned.to_numpy(dtype=float)
+    ]
+    os.makedirs(os.path.join(out_dir, 'metrics'), exist_ok=True)
+    path = os.path.join(out_dir, 'metrics', f'{name}.json')
+    with open(path, 'w') as f:
+        json.dump({'name': name, 'values': out}, f, separators=(',', ':'))
+    return path
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Zonal aggregation of gridded climate fields (ERA5-Land) to SC counties.
+
+Clipping decades of hourly grids polygon by polygon is far too slow, so the
+county geometries are turned once into a sparse county x grid-cell matrix of
+area weights. That matrix is cached to disk, and the field is streamed from
+NetCDF/Zarr in blocks of time steps, so each block is one sparse mat-mul.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Equal area CRS (CONUS Albers) for the cell/county intersection areas
+AREA_CRS = 'EPSG:5070'
+
+
+def grid_cell_edges(centers):
+    # Cell edges sit halfway between the centers, the outer edges are extrapolated
+    centers = np.asarray(centers, dtype=float)
+    mids = (centers[1:] + centers[:-1]) / 2
+    first = centers[0] - (mids[0] - centers[0])
+    last = centers[-1] + (centers[-1] - mids[-1])
+    return np.concatenate([[first], mids, [last]])
+
+
+def _bbox_slice(edges, lo, hi):
+    # Index range of the cells overlapping [lo, hi], works for descending grids too
+    cell_lo = np.minimum(edges[:-1], edges[1:])
+    cell_hi = np.maximum(edges[:-1], edges[1:])
+    hits = np.flatnonzero((cell_hi > lo) & (cell_lo < hi))
+    if hits.size == 0:
+        raise ValueError('The grid does not overlap the county geometries')
+    return hits[0], hits[-1] + 1
+
+
+def build_weights(counties, lat, lon, geoid_col='GEOID'):
+    """
+    Area weights of every grid cell for every county.
+
+    Returns a dict with the CSR weight matrix (counties x cells of the grid
+    window covering the counties), the GEOID order of the rows and the lat/lon
+    index window. Each row sums to 1 so the mat-mul gives area-weighted means.
+    """
+    import geopandas as gpd
+    import shapely
+
+    counties = counties[[geoid_col, 'geometry']].to_crs('EPSG:4326')
+    counties = counties.sort_values(geoid_col).reset_index(drop=True)
+    geoids = counties[geoid_col].astype(str).tolist()
+
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    # ERA5 longitudes may run 0-360, remapping them would break the ordering
+    # of a global grid, so the counties are moved into the grid's convention
+    if lon.max() > 180:
+        counties['geometry'] = counties.translate(xoff=360)
+    lat_edges = grid_cell_edges(lat)
+    lon_edges = grid_cell_edges(lon)
+
+    xmin, ymin, xmax, ymax = counties.total_bounds
+    i0, i1 = _bbox_slice(lat_edges, ymin, ymax)
+    j0, j1 = _bbox_slice(lon_edges, xmin, xmax)
+
+    # One box per cell of the window, numbered row-major like field.reshape()
+    sub_lat = lat_edges[i0:i1 + 1]
+    sub_lon = lon_edges[j0:j1 + 1]
+    lat_lo, lon_lo = np.meshgrid(sub_lat[:-1], sub_lon[:-1], indexing='ij')
+    lat_hi, lon_hi = np.meshgrid(sub_lat[1:], sub_lon[1:], indexing='ij')
+    boxes = shapely.box(
+        np.minimum(lon_lo, lon_hi).ravel(), np.minimum(lat_lo, lat_hi).ravel(),
+        np.maximum(lon_lo, lon_hi).ravel(), np.maximum(lat_lo, lat_hi).ravel()
+    )
+    cells = gpd.GeoDataFrame(
+        {'cell': np.arange(boxes.size)}, geometry=boxes, crs='EPSG:4326'
+    )
+
+    pieces = gpd.overlay(cells, counties, how='intersection', keep_geom_type=True)
+    pieces['area'] = pieces.to_crs(AREA_CRS).area
+    pieces = pieces[pieces['area'] > 0]
+
+    rows = pd.Index(geoids).get_indexer(pieces[geoid_col].astype(str))
+    area = pieces['area'].to_numpy()
+    county_area = np.bincount(rows, weights=area, minlength=len(geoids))
+
+    weights = sp.csr_matrix(
+        (area / county_area[rows], (rows, pieces['cell'].to_numpy())),
+        shape=(len(geoids), boxes.size)
+    )
+    weights.sum_duplicates()
+
+    return {
+        'weights': weights,
+        'geoids': geoids,
+        'lat_window': (int(i0), int(i1)),
+        'lon_window': (int(j0), int(j1)),
+        'lat': lat,
+        'lon': lon,
+    }
+
+
+def save_weights(path, zonal):
+    weights = zonal['weights']
+    np.savez(
+        path,
+        data=weights.data, indices=weights.indices, indptr=weights.indptr,
+        shape=np.asarray(weights.shape),
+        geoids=np.asarray(zonal['geoids']),
+        lat_window=np.asarray(zonal['lat_window']),
+        lon_window=np.asarray(zonal['lon_window']),
+        lat=zonal['lat'], lon=zonal['lon'],
+    )
+
+
+def load_weights(path):
+    with np.load(path) as f:
+        weights = sp.csr_matrix(
+            (f['data'], f['indices'], f['indptr']), shape=tuple(f['shape'])
+        )
+        return {
+            'weights': weights,
+            'geoids': f['geoids'].astype(str).tolist(),
+            'lat_window': tuple(int(i) for i in f['lat_window']),
+            'lon_window': tuple(int(i) for i in f['lon_window']),
+            'lat': f['lat'],
+            'lon': f['lon'],
+        }
+
+
+def cached_weights(path, counties, lat, lon, geoid_col='GEOID'):
+    # Reuse the cached matrix as long as it was built for the same grid
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    if os.path.exists(path):
+        zonal = load_weights(path)
+        if (zonal['lat'].shape == lat.shape and np.allclose(zonal['lat'], lat)
+                and zonal['lon'].shape == lon.shape and np.allclose(zonal['lon'], lon)):
+            return zonal
+
+    zonal = build_weights(counties, lat, lon, geoid_col=geoid_col)
+    save_weights(path, zonal)
+    return zonal
+
+
+def open_field(path, variable):
+    # Lazily opened, nothing is read until a block of time steps is sliced out
+    import xarray as xr
+
+    if path.rstrip('/').endswith('.zarr'):
+        ds = xr.open_zarr(path, chunks=None)
+    else:
+        ds = xr.open_dataset(path, chunks=None)
+    return ds[variable]
+
+
+def aggregate_field(field, zonal, time_dim='time', lat_dim='latitude', lon_dim='longitude',
+                    block_size=744, out_path=None):
+    """
+    Stream a (time, lat, lon) DataArray through the weight matrix.
+
+    Returns a counties x time array (rows in zonal['geoids'] order) and the
+    time coordinate. Missing cells (e.g. ocean in ERA5-Land) are dropped and
+    the remaining weights renormalized. With out_path the result is written
+    to a memory-mapped .npy instead of being held in memory.
+    """
+    weights = zonal['weights']
+    i0, i1 = zonal['lat_window']
+    j0, j1 = zonal['lon_window']
+
+    window = field.isel({lat_dim: slice(i0, i1), lon_dim: slice(j0, j1)})
+    window = window.transpose(time_dim, lat_dim, lon_dim)
+    n_time = window.sizes[time_dim]
+    shape = (weights.shape[0], n_time)
+
+    if out_path is None:
+        out = np.empty(shape)
+    else:
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=float, shape=shape)
+
+    for start in range(0, n_time, block_size):
+        stop = min(start + block_size, n_time)
+        block = window.isel({time_dim: slice(start, stop)}).values
+        block = block.reshape(stop - start, -1)
+
+        valid = np.isfinite(block)
+        total = weights @ np.where(valid, block, 0.0).T
+        coverage = weights @ valid.T.astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[:, start:stop] = np.where(coverage > 0, total / coverage, np.nan)
+
+    if out_path is not None:
+        out.flush()
+    return out, window[time_dim].values
+
+
+def align_to_cube(values, times, zonal, cube, how='mean'):
+    """
+    Resample a counties x time array to years and reorder it onto the county
+    and year axes of a claims_data.ClaimsCube (counties x years).
+    """
+    years = pd.DatetimeIndex(times).year
+    frame = pd.DataFrame(values.T, index=years, columns=zonal['geoids'])
+    annual = frame.groupby(level=0).agg(how)
+    annual = annual.reindex(index=cube.years, columns=cube.counties)
+    return annual.to_numpy().T
+
+
+if __name__ == '__main__':
+    # Synthetic check: a box county around (-81.75, 33.25) on global 0.25 deg
+    # grids in both longitude conventions, with the field equal to longitude
+    import geopandas as gpd
+    import shapely
+    import xarray as xr
+
+    county = gpd.GeoDataFrame(
+        {'GEOID': ['45000']}, geometry=[shapely.box(-82.0, 33.0, -81.5, 33.5)], crs='EPSG:4326'
+    )
+    lat = np.arange(90, -90.1, -0.25)
+    for lon, expected in ((np.arange(0, 360, 0.25), 278.25), (np.arange(-180, 180, 0.25), -81.75)):
+        field = xr.DataArray(
+            np.broadcast_to(lon, (2, lat.size, lon.size)),
+            coords={'time': pd.date_range('2000-01-01', periods=2), 'latitude': lat, 'longitude': lon},
+            dims=('time', 'latitude', 'longitude'),
+        )
+        means, _ = aggregate_field(field, build_weights(county, lat, lon))
+        assert np.allclose(means, expected), (means, expected)
+        print(f'lon {lon[0]:g}..{lon[-1]:g}: county mean {means[0, 0]:.2f}')
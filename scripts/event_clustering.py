@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Group claims into events without relying on SHELDUS EventName.
+
+Two claims belong to the same event when they share a hazard, are within
+`window` months of each other and are in the same or neighbouring counties;
+events are the connected groups of that relation. Claims are sorted by
+hazard and time and swept once, linking each claim to the latest claim of
+its own and each neighbouring county (a union-find keeps the groups). Claims
+of a county within the window are already chained to that latest claim, so
+this gives the same events as comparing every pair, in near-linear time.
+"""
+
+import numpy as np
+import pandas as pd
+
+from claims_data import COUNTY_COL, DMG_COL, HAZARD_COL, YEAR_COL
+
+MONTH_COL = 'Month'
+
+
+def county_adjacency(counties, geoid_col='GEOID'):
+    # GEOID -> set of GEOIDs sharing a border (or a corner)
+    import geopandas as gpd
+
+    shapes = counties[[geoid_col, 'geometry']].reset_index(drop=True)
+    pairs = gpd.sjoin(shapes, shapes, predicate='intersects')
+    pairs = pairs[pairs[f'{geoid_col}_left'] != pairs[f'{geoid_col}_right']]
+
+    adjacency = {g: set() for g in shapes[geoid_col]}
+    for a, b in zip(pairs[f'{geoid_col}_left'], pairs[f'{geoid_col}_right']):
+        adjacency[a].add(b)
+    return adjacency
+
+
+def _find(parent, i):
+    # Path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _union(parent, size, i, j):
+    i, j = _find(parent, i), _find(parent, j)
+    if i == j:
+        return
+    if size[i] < size[j]:
+        i, j = j, i
+    parent[j] = i
+    size[i] += size[j]
+
+
+def _sweep(order, hazard, county, time, adjacency, window, parent, size):
+    last = {}
+    current = None
+    for i in order:
+        if hazard[i] != current:
+            current = hazard[i]
+            last = {}
+        t = time[i]
+        c = county[i]
+
+        j = last.get(c)
+        if j is not None and t - time[j] <= window:
+            _union(parent, size, i, j)
+        for neighbour in adjacency.get(c, ()):
+            j = last.get(neighbour)
+            if j is not None and t - time[j] <= window:
+                _union(parent, size, i, j)
+        last[c] = i
+
+
+def cluster_events(claims, adjacency, window=1, hazard_col=HAZARD_COL, month_col=MONTH_COL):
+    """
+    Event id for every claim (a Series aligned with claims.index).
+
+    window is in months. Claims without a month are clustered at year
+    resolution (same hazard, same year, same or neighbouring county).
+    Ids number the events in order of hazard, then first claim date, so
+    the same claims always get the same ids.
+    """
+    n = len(claims)
+    hazard = claims[hazard_col].astype(str).to_numpy()
+    county = claims[COUNTY_COL].astype(str).to_numpy()
+    year = claims[YEAR_COL].to_numpy(dtype=np.int64)
+    if month_col in claims:
+        month = pd.to_numeric(claims[month_col], errors='coerce').to_numpy(dtype=float)
+    else:
+        month = np.full(n, np.nan)
+    has_month = np.isfinite(month)
+    month0 = np.where(has_month, month - 1, 0).astype(np.int64)
+    time = np.where(has_month, year * 12 + month0, year)
+
+    parent = list(range(n))
+    size = [1] * n
+    hazard_list, county_list, time_list = hazard.tolist(), county.tolist(), time.tolist()
+    for rows, resolution_window in ((np.flatnonzero(has_month), window),
+                                    (np.flatnonzero(~has_month), 0)):
+        order = rows[np.lexsort((county[rows], time[rows], hazard[rows]))]
+        _sweep(order.tolist(), hazard_list, county_list, time_list,
+               adjacency, resolution_window, parent, size)
+
+    # Number the events in (hazard, date, county) order of their first claim
+    order = np.lexsort((county, month0, year, hazard))
+    ids = np.empty(n, dtype=np.int64)
+    labels = {}
+    for i in order.tolist():
+        root = _find(parent, i)
+        ids[i] = labels.setdefault(root, len(labels))
+    return pd.Series(ids, index=claims.index, name='event_id')
+
+
+def event_losses(claims, event_id, value_col=DMG_COL, hazard_col=HAZARD_COL):
+    """
+    One row per event with its span, size and total loss, plus the return
+    interval of that loss among the events of the same hazard
+    (RI = (record_yrs + 1) / rank, as in calc_ri()).
+    """
+    df = claims.assign(event_id=event_id.values)
+    if MONTH_COL in df:
+        df['_month'] = pd.to_numeric(df[MONTH_COL], errors='coerce')
+    else:
+        df['_month'] = np.nan
+
+    named = 'EventName' in df
+    events = df.groupby('event_id').agg(
+        hazard=(hazard_col, 'first'),
+        start_year=(YEAR_COL, 'min'),
+        end_year=(YEAR_COL, 'max'),
+        start_month=('_month', 'min'),
+        n_claims=(value_col, 'size'),
+        n_counties=(COUNTY_COL, 'nunique'),
+        total_dmg=(value_col, 'sum'),
+    )
+    if named:
+        # Most common SHELDUS name among the event's claims, for reference
+        events['event_name'] = df.groupby('event_id')['EventName'].agg(
+            lambda names: names.mode().iloc[0] if names.notna().any() else None
+        )
+
+    record_yrs = df[YEAR_COL].max() - df[YEAR_COL].min()
+    rank = events.groupby('hazard')['total_dmg'].rank(ascending=False).astype(int)
+    events['RI'] = (record_yrs + 1) / rank
+    return events.sort_values('total_dmg', ascending=False)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export the analysis outputs as memory-mappable files.
+
+Tables are written as uncompressed Arrow IPC (Feather v2) files and dense
+arrays as .npy, so readers can memory-map them instead of re-parsing CSV.
+manifest.json lists every file with its schema (or dtype/shape/axes).
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from claims_data import COUNTY_COL, DMG_COL, HAZARD_COL, PERCAP_COL, YEAR_COL, claims_cube
+from quantile_sketch import load_sketches, save_sketches, update_sketches
+from ri_models import calc_ri_matrix, fit_cube, fit_log_params, poisson_grid
+
+MANIFEST = 'manifest.json'
+
+
+def _compact(df):
+    # Repeated strings become categoricals (Arrow dictionary columns)
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object or pd.api.types.is_string_dtype(df[col]):
+            if df[col].nunique() < len(df) / 2:
+                df[col] = df[col].astype('category')
+    return df
+
+
+def write_table(df, path):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = pa.Table.from_pandas(_compact(df), preserve_index=False)
+    # Compression would force a copy on read, keep the buffers mappable
+    feather.write_feather(table, path, compression='uncompressed')
+    return {
+        'format': 'arrow',
+        'rows': table.num_rows,
+        'schema': [{'name': f.name, 'type': str(f.type)} for f in table.schema],
+    }
+
+
+def write_array(values, path, axes=None):
+    np.save(path, np.ascontiguousarray(values))
+    entry = {'format': 'npy', 'dtype': str(values.dtype), 'shape': list(values.shape)}
+    if axes is not None:
+        entry['axes'] = axes
+    return entry
+
+
+def export_outputs(claims, out_dir, poisson_thresholds=None, horizon=100):
+    """
+    Write the cleaned claims, aggregate tables, claims cubes, RI tables,
+    fit parameters, severity sketches and (optionally) Poisson grids to
+    out_dir.
+    Returns the manifest dict that is also saved as manifest.json.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    files = {}
+
+    def table(name, df):
+        files[name] = dict(path=f'{name}.arrow', **write_table(df, os.path.join(out_dir, f'{name}.arrow')))
+
+    def array(name, values, axes):
+        files[name] = dict(path=f'{name}.npy', **write_array(values, os.path.join(out_dir, f'{name}.npy'), axes))
+
+    table('claims', claims)
+
+    # Aggregates
+    table('county_hazard_totals', claims.groupby([COUNTY_COL, HAZARD_COL]).agg(
+        total_dmg_adj=(DMG_COL, 'sum'),
+        total_dmg_percap=(PERCAP_COL, 'sum'),
+        n_claims=(DMG_COL, 'size'),
+    ).reset_index())
+    table('annual_hazard_totals', claims.groupby([YEAR_COL, HAZARD_COL]).agg(
+        total_dmg_adj=(DMG_COL, 'sum'),
+        total_dmg_percap=(PERCAP_COL, 'sum'),
+    ).reset_index())
+
+    # Dense cubes, the axis labels go in the manifest
+    cube = claims_cube(claims)
+    cube_percap = claims_cube(claims, value_col=PERCAP_COL)
+    axes = {
+        HAZARD_COL: cube.hazards,
+        COUNTY_COL: cube.counties,
+        YEAR_COL: cube.years.tolist(),
+    }
+    array('cube_dmg_adj', cube.values, axes)
+    array('cube_dmg_percap', cube_percap.values, axes)
+
+    # Statewide RI tables and fits per hazard, like curve_fit.py
+    statewide = cube.values.sum(axis=1)
+    ri = calc_ri_matrix(statewide, cube.years)
+    observed = np.isfinite(ri)
+    row, col = np.nonzero(observed)
+    table('ri_statewide', pd.DataFrame({
+        HAZARD_COL: np.asarray(cube.hazards)[row],
+        YEAR_COL: cube.years[col],
+        'total_annual_dmg': statewide[row, col],
+        'RI': ri[row, col],
+    }))
+    params = fit_log_params(ri, np.where(observed, statewide, np.nan))
+    table('fit_statewide', pd.DataFrame({HAZARD_COL: cube.hazards, 'a': params[:, 0], 'b': params[:, 1]}))
+    table('fit_county', fit_cube(cube).reset_index())
+
+    # Severity quantile sketches per hazard x county x decade
+    save_sketches(os.path.join(out_dir, 'severity_sketches.npz'), update_sketches({}, claims))
+    files['severity_sketches'] = {
+        'path': 'severity_sketches.npz',
+        'format': 'tdigest',
+        'keys': [HAZARD_COL, COUNTY_COL, 'decade'],
+        'value': DMG_COL,
+    }
+
+    if poisson_thresholds is not None:
+        grids = []
+        for hazard, p in zip(cube.hazards, params):
+            if np.isfinite(p).all():
+                grid = poisson_grid(p, poisson_thresholds, horizon=horizon)
+                grid.insert(0, HAZARD_COL, hazard)
+                grids.append(grid)
+        if grids:
+            table('poisson_statewide', pd.concat(grids, ignore_index=True))
+
+    manifest = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'files': files,
+    }
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def open_outputs(out_dir):
+    """
+    Memory-map everything listed in the manifest: Arrow tables as
+    pyarrow.Table (zero-copy, .to_pandas() when needed) and arrays as
+    read-only np.memmap. Severity sketches load as a dict of TDigests.
+    """
+    import pyarrow as pa
+
+    with open(os.path.join(out_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    outputs = {}
+    for name, entry in manifest['files'].items():
+        path = os.path.join(out_dir, entry['path'])
+        if entry['format'] == 'arrow':
+            outputs[name] = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        elif entry['format'] == 'tdigest':
+            outputs[name] = load_sketches(path)
+        else:
+            outputs[name] = np.load(path, mmap_mode='r')
+    return outputs
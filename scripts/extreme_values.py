@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched extreme value fits: GEV on block (annual) maxima and GPD on
+peaks over a threshold.
+
+Series are rows of a NaN padded array. The negative log-likelihood and its
+gradient are evaluated for a whole batch of rows at once and minimised
+jointly with L-BFGS-B (the rows don't interact, so this is the same as fitting
+them one by one), warm started from L-moment estimates. Batches are spread
+over processes.
+
+Shape parameter xi uses the climate convention, xi > 0 is a heavy tail
+(scipy's genextreme c = -xi).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.special import gamma
+
+from claims_data import COUNTY_COL, DMG_COL, HAZARD_COL
+
+EULER = 0.5772156649015329
+# Below this |xi| the Gumbel/exponential limits are used
+XI_SMALL = 1e-4
+XI_BOUNDS = (-0.5, 1.5)
+# Added per observation outside the support so the line search backs off
+SUPPORT_PENALTY = 1e6
+
+
+# %% Data preparation
+
+def padded_series(claims, by=(HAZARD_COL, COUNTY_COL), value_col=DMG_COL):
+    # Individual claims of each group as rows of a NaN padded array
+    grouped = claims.groupby(list(by), sort=True)
+    row = grouped.ngroup().to_numpy()
+    col = grouped.cumcount().to_numpy()
+
+    values = np.full((row.max() + 1, col.max() + 1), np.nan)
+    values[row, col] = claims[value_col].to_numpy(dtype=float)
+    index = pd.MultiIndex.from_tuples(list(grouped.groups.keys()), names=list(by))
+    return values, index
+
+
+def exceedances(values, threshold=0.9):
+    """
+    Excesses over a per-row threshold. A float in (0, 1) is taken as the
+    quantile of each row, otherwise threshold is the value(s) itself.
+    Returns the padded excesses, the thresholds and the exceedance counts.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    if np.isscalar(threshold) and 0 < threshold < 1:
+        threshold = np.nanquantile(values, threshold, axis=1)
+    threshold = np.broadcast_to(np.asarray(threshold, dtype=float), values.shape[:1])
+
+    with np.errstate(invalid='ignore'):
+        over = values > threshold[:, None]
+    counts = over.sum(axis=1)
+
+    # Pack the excesses to the left of each row
+    excess = np.full((values.shape[0], max(counts.max(), 1)), np.nan)
+    row, col = np.nonzero(over)
+    pos = np.arange(row.size) - np.searchsorted(row, row, side='left')
+    excess[row, pos] = (values - threshold[:, None])[row, col]
+    return excess, threshold, counts
+
+
+def l_moments(values):
+    # First three sample L-moments of each row (unbiased PWM estimates)
+    x = np.sort(np.atleast_2d(np.asarray(values, dtype=float)), axis=1)
+    n = np.isfinite(x).sum(axis=1).astype(float)[:, None]
+    i = np.arange(x.shape[1])[None, :]
+    x0 = np.where(np.isfinite(x), x, 0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b0 = x0.sum(axis=1, keepdims=True) / n
+        b1 = (x0 * i / (n - 1)).sum(axis=1, keepdims=True) / n
+        b2 = (x0 * i * (i - 1) / ((n - 1) * (n - 2))).sum(axis=1, keepdims=True) / n
+    l1 = b0
+    l2 = 2 * b1 - b0
+    l3 = 6 * b2 - 6 * b1 + b0
+    return l1[:, 0], l2[:, 0], l3[:, 0]
+
+
+# %% Likelihoods
+
+def _gev_nll(theta, x, mask):
+    # theta: (n, 3) of (mu, log sigma, xi) on standardized data
+    mu, phi, xi = theta[:, 0:1], theta[:, 1:2], theta[:, 2:3]
+    s = np.exp(phi)
+    z = (x - mu) / s
+    small = np.abs(xi) < XI_SMALL
+    xs = np.where(small, XI_SMALL, xi)
+
+    t = 1 + xs * z
+    valid = mask & (small | (t > 0))
+    tt = np.where(valid & ~small, t, 1.0)
+    logt = np.log(tt)
+    u = np.exp(-logt / xs)
+    nll = phi + (1 + 1 / xs) * logt + u
+    g_mu = -(xs + 1 - u) / (s * tt)
+    g_phi = 1 - (xs + 1 - u) * z / tt
+    g_xi = (u - 1) * logt / xs ** 2 + (xs + 1 - u) * z / (xs * tt)
+
+    # Gumbel limit
+    zg = np.where(valid & small, z, 0.0)
+    ez = np.exp(-zg)
+    nll = np.where(small, phi + zg + ez, nll)
+    g_mu = np.where(small, -(1 - ez) / s, g_mu)
+    g_phi = np.where(small, 1 - zg + zg * ez, g_phi)
+    g_xi = np.where(small, zg - zg ** 2 * (1 - ez) / 2, g_xi)
+
+    bad = mask & ~valid
+    value = np.where(valid, nll, 0.0).sum() + SUPPORT_PENALTY * bad.sum()
+    grad = np.column_stack([
+        np.where(valid, g_mu, 0.0).sum(axis=1),
+        np.where(valid, g_phi, 0.0).sum(axis=1),
+        np.where(valid, g_xi, 0.0).sum(axis=1),
+    ])
+    return value, grad
+
+
+def _gpd_nll(theta, y, mask):
+    # theta: (n, 2) of (log sigma, xi) on standardized excesses
+    phi, xi = theta[:, 0:1], theta[:, 1:2]
+    s = np.exp(phi)
+    w = y / s
+    small = np.abs(xi) < XI_SMALL
+    xs = np.where(small, XI_SMALL, xi)
+
+    t = 1 + xs * w
+    valid = mask & (small | (t > 0))
+    tt = np.where(valid & ~small, t, 1.0)
+    logt = np.log(tt)
+    nll = phi + (1 + 1 / xs) * logt
+    g_phi = 1 - (xs + 1) * w / tt
+    g_xi = -logt / xs ** 2 + (1 + 1 / xs) * w / tt
+
+    # Exponential limit
+    wg = np.where(valid & small, w, 0.0)
+    nll = np.where(small, phi + wg, nll)
+    g_phi = np.where(small, 1 - wg, g_phi)
+    g_xi = np.where(small, wg - wg ** 2 / 2, g_xi)
+
+    bad = mask & ~valid
+    value = np.where(valid, nll, 0.0).sum() + SUPPORT_PENALTY * bad.sum()
+    grad = np.column_stack([
+        np.where(valid, g_phi, 0.0).sum(axis=1),
+        np.where(valid, g_xi, 0.0).sum(axis=1),
+    ])
+    return value, grad
+
+
+def _minimize_batch(nll, theta0, data, mask, xi_col):
+    n, k = theta0.shape
+    bounds = [(None, None)] * k
+    bounds[xi_col] = XI_BOUNDS
+    data = np.where(mask, data, 0.0)
+
+    def objective(flat):
+        value, grad = nll(flat.reshape(n, k), data, mask)
+        return value, grad.ravel()
+
+    result = minimize(
+        objective, theta0.ravel(), jac=True, method='L-BFGS-B',
+        bounds=bounds * n, options={'maxiter': 1000, 'ftol': 1e-13, 'gtol': 1e-7}
+    )
+    return result.x.reshape(n, k)
+
+
+# %% Fitting
+
+def _gev_batch(x):
+    mask = np.isfinite(x)
+    l1, l2, l3 = l_moments(x)
+
+    # Hosking's L-moment estimators, k = -xi
+    with np.errstate(invalid='ignore', divide='ignore'):
+        c = 2 / (3 + l3 / l2) - np.log(2) / np.log(3)
+        k = 7.8590 * c + 2.9554 * c ** 2
+        k = np.where(np.abs(k) < XI_SMALL, XI_SMALL, k)
+        sigma = l2 * k / ((1 - 2 ** -k) * gamma(1 + k))
+        mu = l1 - sigma * (1 - gamma(1 + k)) / k
+    xi = np.clip(-k, XI_BOUNDS[0] + 0.01, XI_BOUNDS[1] - 0.01)
+
+    # Gumbel moments where the L-moment start is unusable
+    fallback = ~(np.isfinite(sigma) & (sigma > 0))
+    sd = np.nanstd(x, axis=1)
+    gumbel_sigma = np.sqrt(6) * sd / np.pi
+    sigma = np.where(fallback, gumbel_sigma, sigma)
+    mu = np.where(fallback, l1 - EULER * gumbel_sigma, mu)
+    xi = np.where(fallback, 0.0, xi)
+    sigma = np.where(sigma > 0, sigma, 1.0)
+
+    # Fit on standardized data
+    loc0, scale0 = mu, sigma
+    xz = (x - loc0[:, None]) / scale0[:, None]
+    theta0 = np.column_stack([np.zeros_like(xi), np.zeros_like(xi), xi])
+    with np.errstate(invalid='ignore'):
+        outside = (mask & (1 + xi[:, None] * xz <= 0)).any(axis=1)
+    theta0[outside, 2] = 0.0
+
+    theta = _minimize_batch(_gev_nll, theta0, xz, mask, xi_col=2)
+    return np.column_stack([
+        loc0 + scale0 * theta[:, 0],
+        scale0 * np.exp(theta[:, 1]),
+        theta[:, 2],
+    ])
+
+
+def _gpd_batch(y):
+    mask = np.isfinite(y)
+    l1, l2, _ = l_moments(y)
+
+    # Hosking's L-moment estimators on the excesses, k = -xi
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k = l1 / l2 - 2
+        sigma = (1 + k) * l1
+    xi = np.clip(-k, XI_BOUNDS[0] + 0.01, XI_BOUNDS[1] - 0.01)
+
+    fallback = ~(np.isfinite(sigma) & (sigma > 0))
+    sigma = np.where(fallback, l1, sigma)
+    xi = np.where(fallback, 0.0, xi)
+    scale0 = np.where(l1 > 0, l1, 1.0)
+
+    yz = y / scale0[:, None]
+    theta0 = np.column_stack([np.log(np.where(sigma > 0, sigma, scale0) / scale0), xi])
+    with np.errstate(invalid='ignore'):
+        outside = (mask & (1 + xi[:, None] * yz / np.exp(theta0[:, 0:1]) <= 0)).any(axis=1)
+    theta0[outside, 1] = 0.0
+
+    theta = _minimize_batch(_gpd_nll, theta0, yz, mask, xi_col=1)
+    return np.column_stack([scale0 * np.exp(theta[:, 0]), theta[:, 1]])
+
+
+def _fit_batches(batch_fit, values, n_params, min_obs, batch_size, n_workers):
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    params = np.full((values.shape[0], n_params), np.nan)
+    rows = np.flatnonzero(np.isfinite(values).sum(axis=1) >= min_obs)
+    batches = [values[rows[i:i + batch_size]] for i in range(0, rows.size, batch_size)]
+
+    if n_workers is None:
+        n_workers = min(os.cpu_count() or 1, len(batches))
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            fits = list(pool.map(batch_fit, batches))
+    else:
+        fits = [batch_fit(b) for b in batches]
+
+    if fits:
+        params[rows] = np.concatenate(fits)
+    return params
+
+
+def fit_gev(maxima, min_obs=10, batch_size=256, n_workers=None):
+    """
+    GEV fit of every row of a series x blocks array (NaN = missing block).
+
+    Use claims_cube(..., agg='max') rows for annual maxima; rows of the
+    annual totals cube give curves on the same footing as ri_model_fitting().
+    Zeros (years without claims) should be set to NaN first.
+    Returns (n_series, 3) of (mu, sigma, xi), NaN below min_obs blocks.
+    """
+    return _fit_batches(_gev_batch, maxima, 3, min_obs, batch_size, n_workers)
+
+
+def fit_gpd(excess, min_obs=10, batch_size=256, n_workers=None):
+    """
+    GPD fit of every row of padded excesses (see exceedances()).
+    Returns (n_series, 2) of (sigma, xi), NaN below min_obs exceedances.
+    """
+    return _fit_batches(_gpd_batch, excess, 2, min_obs, batch_size, n_workers)
+
+
+# %% Return levels
+
+def gev_return_levels(params, ri):
+    """
+    Level exceeded once every `ri` years (ri > 1), one row per series.
+    ri can be the modeling_domain of curve_fit.py or calc_ri output.
+    """
+    params = np.atleast_2d(params)
+    mu, sigma, xi = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+    y = -np.log(1 - 1 / np.asarray(ri, dtype=float))
+    small = np.abs(xi) < XI_SMALL
+    xs = np.where(small, 1.0, xi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(small, mu - sigma * np.log(y), mu + sigma / xs * (y ** -xs - 1))
+
+
+def gpd_return_levels(params, threshold, rate, ri):
+    """
+    Level exceeded once every `ri` years from a POT fit, where rate is the
+    mean number of exceedances per year (counts / record years). Valid for
+    rate * ri >= 1.
+    """
+    params = np.atleast_2d(params)
+    sigma, xi = params[:, 0:1], params[:, 1:2]
+    m = np.asarray(rate, dtype=float).reshape(-1, 1) * np.asarray(ri, dtype=float)
+    u = np.asarray(threshold, dtype=float).reshape(-1, 1)
+    small = np.abs(xi) < XI_SMALL
+    xs = np.where(small, 1.0, xi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(small, u + sigma * np.log(m), u + sigma / xs * (m ** xs - 1))
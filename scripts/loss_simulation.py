@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo annual losses from the fitted RI models.
+
+log_func says annual damages reach x once every 10 ** ((x - b) / a) years, so
+a synthetic year is an inverse-CDF draw, loss = b - a * log10(u) for uniform u.
+Years are drawn in NumPy batches, split into fixed-size tasks with their own
+RNG stream (so results only depend on the seed, not the worker count) and
+spread over processes. Series are treated as independent.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DEFAULT_RETURN_PERIODS = (10, 25, 50, 100, 250, 500)
+
+
+def draw_annual_losses(params, n_years, rng):
+    # n_years x n_series losses, series with unusable fits (a <= 0) lose nothing
+    params = np.atleast_2d(params)
+    a, b = params[:, 0], params[:, 1]
+    usable = np.isfinite(a) & np.isfinite(b) & (a > 0)
+
+    u = 1.0 - rng.random((n_years, params.shape[0]))  # (0, 1], avoids log10(0)
+    losses = b - a * np.log10(u)
+    return np.where(usable, np.maximum(losses, 0.0), 0.0)
+
+
+def loss_bin_edges(params, n_bins=512, tail_prob=1e-9):
+    """
+    Histogram edges per series: a first bin [0, lo) for the years without
+    loss, then n_bins log-spaced bins from the smallest possible loss (b) to
+    the loss with annual exceedance probability tail_prob. Losses beyond the
+    top edge are counted in the last bin.
+    """
+    params = np.atleast_2d(params)
+    a, b = params[:, 0], params[:, 1]
+    a = np.where(np.isfinite(a) & (a > 0), a, 1.0)
+    b = np.where(np.isfinite(b), b, 0.0)
+
+    # Fits with b < -9a (or unusable ones) hardly ever lose anything, keep
+    # their edges positive anyway
+    hi = np.maximum(b - a * np.log10(tail_prob), 1.0)
+    lo = np.maximum(b, hi * 1e-6)
+    steps = np.linspace(0, 1, n_bins + 1)
+    edges = lo[:, None] * (hi / lo)[:, None] ** steps
+    return np.concatenate([np.zeros((edges.shape[0], 1)), edges], axis=1)
+
+
+def _bin_index(losses, edges):
+    # Zero losses go to bin 0, the rest of the edges are geometric, so the
+    # bin is found in closed form (no searchsorted)
+    n_bins = edges.shape[1] - 2
+    lo, hi = edges[:, 1], edges[:, -1]
+    with np.errstate(divide='ignore'):
+        pos = np.log(np.maximum(losses, lo) / lo) / np.log(hi / lo)
+    idx = np.clip((pos * n_bins).astype(np.int64), 0, n_bins - 1) + 1
+    return np.where(losses > 0, idx, 0)
+
+
+def _simulate_task(args):
+    params, groups, edges, n_years, batch_size, seed = args
+    rng = np.random.default_rng(seed)
+    n_series = params.shape[0]
+    n_bins = edges.shape[1] - 1
+    offsets = np.arange(n_series) * n_bins
+
+    hist = np.zeros(n_series * n_bins, dtype=np.int64)
+    portfolio = np.empty((n_years, groups.shape[1]))
+
+    for start in range(0, n_years, batch_size):
+        stop = min(start + batch_size, n_years)
+        losses = draw_annual_losses(params, stop - start, rng)
+        idx = _bin_index(losses, edges) + offsets
+        hist += np.bincount(idx.ravel(), minlength=hist.size)
+        portfolio[start:stop] = losses @ groups
+
+    return hist.reshape(n_series, n_bins), portfolio
+
+
+def simulate(params, n_years=1_000_000, groups=None, n_bins=512, batch_size=20_000,
+             task_years=250_000, n_workers=None, seed=None):
+    """
+    Simulate n_years synthetic years for every series.
+
+    params: (n_series, 2) array of fitted (a, b), e.g. ri_models.fit_cube().
+    groups: optional (n_series, n_portfolios) 0/1 matrix of portfolio
+    membership (e.g. one column per hazard); default is one portfolio of all
+    series.
+
+    Returns a dict with per-series loss histograms ('hist', 'edges', n_bins + 1
+    bins of which the first counts the years without loss) and the
+    simulated annual losses of each portfolio ('portfolio', n_years x
+    n_portfolios), in year order so they can be cut into horizons.
+    """
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    n_series = params.shape[0]
+    if groups is None:
+        groups = np.ones((n_series, 1))
+    groups = np.asarray(groups, dtype=float)
+    edges = loss_bin_edges(params, n_bins)
+
+    sizes = [min(task_years, n_years - s) for s in range(0, n_years, task_years)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(params, groups, edges, size, batch_size, s) for size, s in zip(sizes, seeds)]
+
+    if n_workers is None:
+        n_workers = min(os.cpu_count() or 1, len(tasks))
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_simulate_task, tasks))
+    else:
+        results = [_simulate_task(t) for t in tasks]
+
+    return {
+        'hist': sum(r[0] for r in results),
+        'edges': edges,
+        'portfolio': np.concatenate([r[1] for r in results]),
+    }
+
+
+def exceedance_curve(losses):
+    # Empirical exceedance probability of each simulated loss, largest first
+    losses = np.sort(np.asarray(losses))[::-1]
+    prob = np.arange(1, losses.size + 1) / losses.size
+    return losses, prob
+
+
+def pml(losses, return_periods=DEFAULT_RETURN_PERIODS, axis=0):
+    # Probable maximum loss: the loss exceeded once per return period on average
+    probs = 1 - 1 / np.asarray(return_periods, dtype=float)
+    return np.quantile(losses, probs, axis=axis)
+
+
+def hist_exceedance(hist, edges):
+    # Per-series exceedance probability at each upper bin edge
+    counts = hist.cumsum(axis=1)
+    return edges[:, 1:], 1 - counts / counts[:, -1:]
+
+
+def hist_pml(hist, edges, return_periods=DEFAULT_RETURN_PERIODS):
+    """
+    Per-series PML read off the histogram, interpolated in log space within a
+    bin. Return periods inside the zero-loss mass (e.g. every return period of
+    a series with an unusable fit) have a PML of 0.
+    """
+    probs = 1 - 1 / np.asarray(return_periods, dtype=float)
+    # CDF at the upper edges, the first one is the share of zero-loss years
+    cdf = hist.cumsum(axis=1) / hist.sum(axis=1, keepdims=True)
+    out = np.empty((hist.shape[0], probs.size))
+    for i in range(hist.shape[0]):
+        loss = np.exp(np.interp(probs, cdf[i], np.log(edges[i, 1:])))
+        out[i] = np.where(probs <= cdf[i, 0], 0.0, loss)
+    return out
+
+
+def horizon_summary(portfolio, horizon=100, return_periods=DEFAULT_RETURN_PERIODS):
+    """
+    Cut the simulated years into back-to-back horizons (e.g. 100 year blocks)
+    and summarise each portfolio's worst year and total loss per horizon.
+    """
+    n = portfolio.shape[0] // horizon
+    blocks = portfolio[:n * horizon].reshape(n, horizon, -1)
+    worst_year = blocks.max(axis=1)
+    total = blocks.sum(axis=1)
+    probs = np.linspace(0, 1, 101)
+    return {
+        'worst_year': worst_year,
+        'total': total,
+        'worst_year_quantiles': np.quantile(worst_year, probs, axis=0),
+        'total_quantiles': np.quantile(total, probs, axis=0),
+        'pml': pml(portfolio, return_periods),
+    }
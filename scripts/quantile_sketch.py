@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mergeable streaming quantile sketches (t-digest) of claim severity.
+
+One digest per hazard x county x decade is built from the claims in
+chunks, so the raw claims never need to be in memory or sorted at once.
+Digests from different chunks, files (states) or processes merge by
+pooling their centroids, and the whole set is saved to a single .npz next
+to the other exported outputs. Median/P90/P99 claims of any group or
+rollup are then read from the centroids.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from claims_data import COUNTY_COL, DMG_COL, HAZARD_COL, YEAR_COL, format_fips
+
+SKETCH_KEYS = (HAZARD_COL, COUNTY_COL, 'decade')
+DEFAULT_DELTA = 500
+# Points are kept raw (exact quantiles) until there are this many per delta
+BUFFER_FACTOR = 4
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _compress(means, weights, delta):
+    """
+    Merge sorted points into centroids no wider than one unit of the k1 scale
+    function k(q) = delta / (2 pi) * asin(2q - 1), which keeps the clusters
+    small in the tails where the P99 lives.
+    """
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order], weights[order]
+    total = weights.sum()
+    q_mid = (np.cumsum(weights) - weights / 2) / total
+    k = delta / (2 * np.pi) * np.arcsin(np.clip(2 * q_mid - 1, -1, 1))
+    bins = np.floor(k + delta / 4).astype(np.int64)
+
+    w = np.bincount(bins, weights=weights)
+    m = np.bincount(bins, weights=weights * means)
+    used = w > 0
+    return m[used] / w[used], w[used]
+
+
+class TDigest:
+    """
+    t-digest of one group; update() with new values, merge() with others.
+    Small groups stay as raw points, so their quantiles are exact.
+    """
+
+    def __init__(self, delta=DEFAULT_DELTA, means=None, weights=None, vmin=np.inf, vmax=-np.inf):
+        self.delta = delta
+        self.means = np.empty(0) if means is None else np.asarray(means, dtype=float)
+        self.weights = np.empty(0) if weights is None else np.asarray(weights, dtype=float)
+        self.min = vmin
+        self.max = vmax
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._absorb(values, np.ones(values.size))
+        return self
+
+    def _absorb(self, means, weights):
+        self.means = np.concatenate([self.means, means])
+        self.weights = np.concatenate([self.weights, weights])
+        if self.means.size > BUFFER_FACTOR * self.delta:
+            self.means, self.weights = _compress(self.means, self.weights, self.delta)
+
+    def copy(self):
+        return TDigest(self.delta, self.means.copy(), self.weights.copy(), self.min, self.max)
+
+    def merge(self, other):
+        if other.weights.size == 0:
+            return self
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._absorb(other.means, other.weights)
+        return self
+
+    def quantile(self, q):
+        # Interpolate between centroid centres, pinned to the exact min and max
+        q = np.asarray(q, dtype=float)
+        if self.weights.size == 0:
+            return np.full(q.shape, np.nan)
+        if (self.weights == 1).all():
+            return np.quantile(self.means, q)
+        order = np.argsort(self.means, kind='stable')
+        means, weights = self.means[order], self.weights[order]
+        total = self.count
+        centres = np.cumsum(weights) - weights / 2
+        positions = np.concatenate([[0.0], centres, [total]])
+        values = np.concatenate([[self.min], means, [self.max]])
+        return np.interp(q * total, positions, values)
+
+
+# %% Building
+
+def update_sketches(sketches, claims, value_col=DMG_COL, delta=DEFAULT_DELTA):
+    # Add one chunk of claims to the {(hazard, county, decade): TDigest} dict
+    claims = claims[claims[value_col] > 0]
+    decade = (claims[YEAR_COL] // 10 * 10).rename('decade')
+    grouped = claims[value_col].groupby([claims[HAZARD_COL], claims[COUNTY_COL], decade])
+    for key, values in grouped:
+        key = (str(key[0]), str(key[1]), int(key[2]))
+        if key not in sketches:
+            sketches[key] = TDigest(delta)
+        sketches[key].update(values.to_numpy())
+    return sketches
+
+
+def sketch_csv(path, value_col=DMG_COL, delta=DEFAULT_DELTA, chunksize=500_000):
+    # Stream a cleaned claims csv (claims_v2 layout) chunk by chunk
+    sketches = {}
+    columns = [HAZARD_COL, COUNTY_COL, YEAR_COL, value_col]
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+        chunk[COUNTY_COL] = format_fips(chunk[COUNTY_COL])
+        update_sketches(sketches, chunk, value_col, delta)
+    return sketches
+
+
+def merge_sketches(*sketch_sets):
+    merged = {}
+    for sketches in sketch_sets:
+        for key, digest in sketches.items():
+            if key in merged:
+                merged[key].merge(digest)
+            else:
+                merged[key] = digest.copy()
+    return merged
+
+
+def sketch_files(paths, value_col=DMG_COL, delta=DEFAULT_DELTA, n_workers=None):
+    # One process per file (e.g. per state), merged at the end
+    if n_workers is None:
+        n_workers = min(os.cpu_count() or 1, len(paths))
+    args = [(p, value_col, delta) for p in paths]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            parts = list(pool.map(sketch_csv, *zip(*args)))
+    else:
+        parts = [sketch_csv(*a) for a in args]
+    return merge_sketches(*parts)
+
+
+# %% Queries
+
+def rollup(sketches, keep=(HAZARD_COL,), select=None):
+    """
+    Merge digests down to the `keep` keys (any of hazard_broad,
+    County_FIPS, decade). select is an optional predicate on the
+    (hazard, county, decade) key.
+    """
+    positions = [SKETCH_KEYS.index(k) for k in keep]
+    out = {}
+    for key, digest in sketches.items():
+        if select is not None and not select(key):
+            continue
+        reduced = tuple(key[i] for i in positions)
+        if reduced in out:
+            out[reduced].merge(digest)
+        else:
+            out[reduced] = digest.copy()
+    return out
+
+
+def quantile_table(sketches, quantiles=DEFAULT_QUANTILES, keys=SKETCH_KEYS):
+    # One row per sketch with its count and the requested quantiles
+    rows = []
+    for key, digest in sorted(sketches.items()):
+        row = dict(zip(keys, key))
+        row['n_claims'] = int(digest.count)
+        row.update({f'q{q:g}': v for q, v in zip(quantiles, digest.quantile(quantiles))})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# %% Storage
+
+def save_sketches(path, sketches):
+    # All digests in one .npz: keys, centroid offsets and the pooled centroids
+    keys = sorted(sketches)
+    digests = [sketches[k] for k in keys]
+    sizes = [d.means.size for d in digests]
+    np.savez(
+        path,
+        hazards=np.asarray([k[0] for k in keys], dtype=str),
+        counties=np.asarray([k[1] for k in keys], dtype=str),
+        decades=np.asarray([k[2] for k in keys], dtype=np.int64),
+        offsets=np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+        means=np.concatenate([d.means for d in digests]) if digests else np.empty(0),
+        weights=np.concatenate([d.weights for d in digests]) if digests else np.empty(0),
+        mins=np.asarray([d.min for d in digests], dtype=float),
+        maxs=np.asarray([d.max for d in digests], dtype=float),
+        delta=np.asarray([digests[0].delta if digests else DEFAULT_DELTA]),
+    )
+
+
+def load_sketches(path):
+    sketches = {}
+    with np.load(path) as f:
+        arrays = {name: f[name] for name in f.files}
+
+    delta = int(arrays['delta'][0])
+    offsets = arrays['offsets']
+    keys = zip(arrays['hazards'].tolist(), arrays['counties'].tolist(), arrays['decades'].tolist())
+    for i, key in enumerate(keys):
+        a, b = offsets[i], offsets[i + 1]
+        sketches[key] = TDigest(delta, arrays['means'][a:b], arrays['weights'][a:b],
+                                float(arrays['mins'][i]), float(arrays['maxs'][i]))
+    return sketches
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local HTTP query service over the claims aggregates.
+
+The claims are read once and summed into hazard x county x year cubes, and
+slice/rollup/RI/fit questions are answered from those cubes as JSON:
+
+    GET /slice?county=Charleston&hazard=GeneralStorm&start=2000&value=percap
+    GET /rollup?by=hazard&county=coastal&top=3
+    GET /ri?hazard=GeneralStorm
+    GET /fit?hazard=GeneralStorm&county=45019
+    GET /quantile?hazard=Hurricane/TropicalStorm&q=0.5,0.9,0.99
+    GET /metrics
+
+Results are kept in a bounded LRU cache keyed by the normalized query, so
+the same question asked with a different parameter order, county spelling
+or list order is a cache hit. /metrics reports the hit rate.
+"""
+
+import argparse
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from claims_data import COUNTY_COL, DMG_COL, PERCAP_COL, claims_cube, load_claims
+from quantile_sketch import DEFAULT_QUANTILES, rollup, update_sketches
+from ri_models import calc_ri_matrix, fit_log_params
+
+# Parameters read by each endpoint besides county, hazard, start and end
+ENDPOINT_PARAMS = {
+    'slice': ('value', 'by'),
+    'rollup': ('value', 'by', 'top'),
+    'ri': ('value',),
+    'fit': ('value',),
+    'quantile': ('q',),
+}
+ENDPOINTS = tuple(ENDPOINT_PARAMS)
+VALUE_COLS = {'dmg': DMG_COL, 'percap': PERCAP_COL}
+
+# Named county groups, the 8 counties of the SC coastal zone
+COUNTY_GROUPS = {
+    'coastal': ['45013', '45015', '45019', '45029', '45035', '45043', '45051', '45053'],
+}
+
+
+class ResultCache:
+    """Thread safe LRU cache of query results with hit/miss counters."""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+
+        # Computed outside the lock, two threads may race on the same key
+        result = compute()
+        with self._lock:
+            self._items[key] = result
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class ClaimsQueries:
+    """Aggregates loaded once, and the queries answered from them."""
+
+    def __init__(self, claims, cache_size=512):
+        self.cubes = {name: claims_cube(claims, value_col=col) for name, col in VALUE_COLS.items()}
+        cube = self.cubes['dmg']
+        self.hazards = cube.hazards
+        self.counties = cube.counties
+        self.years = cube.years
+        self.sketches = update_sketches({}, claims)
+        self.cache = ResultCache(cache_size)
+
+        names = claims.groupby(COUNTY_COL)['CountyName'].first() if 'CountyName' in claims else {}
+        self.county_names = dict(names)
+        self._county_lookup = {self._name_key(n): f for f, n in self.county_names.items()}
+
+    @staticmethod
+    def _name_key(name):
+        name = str(name).strip().lower()
+        return name[:-len(' county')] if name.endswith(' county') else name
+
+    # %% Parameter normalization
+
+    def _resolve_counties(self, values):
+        fips = set()
+        for v in values:
+            key = self._name_key(v)
+            if key in COUNTY_GROUPS:
+                fips.update(COUNTY_GROUPS[key])
+            elif key.isdigit():
+                if key.zfill(5) not in self.counties:
+                    raise ValueError(f'Unknown county: {v}')
+                fips.add(key.zfill(5))
+            elif key in self._county_lookup:
+                fips.add(self._county_lookup[key])
+            else:
+                raise ValueError(f'Unknown county: {v}')
+        return tuple(sorted(fips))
+
+    def _resolve_hazards(self, values):
+        lookup = {h.lower(): h for h in self.hazards}
+        try:
+            return tuple(sorted({lookup[v.strip().lower()] for v in values}))
+        except KeyError as err:
+            raise ValueError(f'Unknown hazard: {err.args[0]}')
+
+    def normalize(self, endpoint, params):
+        """
+        Canonical, hashable form of a query: lists are split on commas,
+        county names/groups resolved to FIPS and everything sorted. Only the
+        parameters the endpoint reads are kept, anything else is rejected.
+        """
+        def values(name):
+            out = []
+            for v in params.get(name, []):
+                out.extend(p for p in v.split(',') if p.strip())
+            return out
+
+        unused = set(params) - {'county', 'hazard', 'start', 'end'} - set(ENDPOINT_PARAMS[endpoint])
+        if unused:
+            raise ValueError(f"/{endpoint} does not take {', '.join(sorted(unused))}")
+
+        query = {
+            'counties': self._resolve_counties(values('county')),
+            'hazards': self._resolve_hazards(values('hazard')),
+            'start': int(values('start')[0]) if values('start') else None,
+            'end': int(values('end')[0]) if values('end') else None,
+        }
+        if 'value' in ENDPOINT_PARAMS[endpoint]:
+            query['value'] = (values('value') or ['dmg'])[0].lower()
+            if query['value'] not in VALUE_COLS:
+                raise ValueError(f"value must be one of {sorted(VALUE_COLS)}")
+        if 'by' in ENDPOINT_PARAMS[endpoint]:
+            query['by'] = (values('by') or [None])[0]
+            if query['by'] not in (None, 'county', 'hazard', 'year'):
+                raise ValueError('by must be county, hazard or year')
+        if 'top' in ENDPOINT_PARAMS[endpoint]:
+            query['top'] = int(values('top')[0]) if values('top') else None
+        if 'q' in ENDPOINT_PARAMS[endpoint]:
+            query['q'] = tuple(sorted({float(q) for q in values('q')})) or DEFAULT_QUANTILES
+            if not all(0 <= q <= 1 for q in query['q']):
+                raise ValueError('q must be between 0 and 1')
+        return (endpoint,) + tuple(sorted(query.items(), key=lambda kv: kv[0]))
+
+    # %% Queries
+
+    def _select(self, query):
+        cube = self.cubes[query['value']]
+        h = [self.hazards.index(x) for x in query['hazards']] or slice(None)
+        c = slice(None)
+        if query['counties']:
+            c = [self.counties.index(x) for x in query['counties'] if x in self.counties]
+        keep = np.ones(self.years.size, dtype=bool)
+        if query['start'] is not None:
+            keep &= self.years >= query['start']
+        if query['end'] is not None:
+            keep &= self.years <= query['end']
+
+        values = cube.values[h][:, c][:, :, keep]
+        hazards = np.asarray(self.hazards)[h].tolist()
+        counties = np.asarray(self.counties)[c].tolist()
+        return values, hazards, counties, self.years[keep]
+
+    def query(self, endpoint, params):
+        key = self.normalize(endpoint, params)
+        handler = getattr(self, f'_q_{endpoint}')
+        return self.cache.get(key, lambda: handler(dict(key[1:])))
+
+    def _q_slice(self, query):
+        # Annual totals of the selection, optionally split by county or hazard
+        values, hazards, counties, years = self._select(query)
+        if query['by'] == 'hazard':
+            table = pd.DataFrame(values.sum(axis=1), index=hazards, columns=years)
+        elif query['by'] == 'county':
+            table = pd.DataFrame(values.sum(axis=0), index=counties, columns=years)
+        else:
+            table = pd.DataFrame([values.sum(axis=(0, 1))], index=['total'], columns=years)
+        return {str(k): dict(zip(years.tolist(), row.tolist())) for k, row in table.iterrows()}
+
+    def _q_rollup(self, query):
+        # Totals of the selection ranked by county, hazard or year
+        values, hazards, counties, years = self._select(query)
+        by = query['by'] or 'hazard'
+        if by == 'hazard':
+            totals = pd.Series(values.sum(axis=(1, 2)), index=hazards)
+        elif by == 'county':
+            totals = pd.Series(values.sum(axis=(0, 2)), index=counties)
+        else:
+            totals = pd.Series(values.sum(axis=(0, 1)), index=years)
+        totals = totals.sort_values(ascending=False)
+        if query['top']:
+            totals = totals.head(query['top'])
+        rows = []
+        for key, total in totals.items():
+            row = {by: int(key) if by == 'year' else key, 'total': float(total)}
+            if by == 'county':
+                row['name'] = self.county_names.get(key)
+            rows.append(row)
+        return rows
+
+    def _q_ri(self, query):
+        values, _, _, years = self._select(query)
+        annual = values.sum(axis=(0, 1))
+        ri = calc_ri_matrix(annual, years)[0]
+        observed = np.isfinite(ri)
+        return [
+            {'Year': int(y), 'total': float(v), 'RI': float(r)}
+            for y, v, r in zip(years[observed], annual[observed], ri[observed])
+        ]
+
+    def _q_fit(self, query):
+        values, _, _, years = self._select(query)
+        annual = values.sum(axis=(0, 1))
+        ri = calc_ri_matrix(annual, years)
+        a, b = fit_log_params(ri, np.where(np.isfinite(ri), annual, np.nan))[0]
+        if not (np.isfinite(a) and np.isfinite(b)):
+            raise ValueError('Not enough years with claims to fit')
+        return {'a': float(a), 'b': float(b), 'n_years': int(np.isfinite(ri).sum())}
+
+    def _q_quantile(self, query):
+        # Claim severity quantiles from the sketches, years filter by decade
+        def select(key):
+            hazard, county, decade = key
+            return ((not query['hazards'] or hazard in query['hazards'])
+                    and (not query['counties'] or county in query['counties'])
+                    and (query['start'] is None or decade + 9 >= query['start'])
+                    and (query['end'] is None or decade <= query['end']))
+
+        digest = rollup(self.sketches, keep=(), select=select).get(())
+        if digest is None:
+            return {'n_claims': 0}
+        result = {f'q{q:g}': float(v) for q, v in zip(query['q'], digest.quantile(query['q']))}
+        result['n_claims'] = int(digest.count)
+        return result
+
+
+def make_handler(queries):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body):
+            payload = json.dumps(body, allow_nan=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            endpoint = url.path.strip('/')
+            if endpoint == 'metrics':
+                return self._send(200, queries.cache.metrics())
+            if endpoint not in ENDPOINTS:
+                return self._send(404, {'error': f'Unknown endpoint: /{endpoint}'})
+            try:
+                self._send(200, queries.query(endpoint, parse_qs(url.query)))
+            except ValueError as err:
+                self._send(400, {'error': str(err)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(claims_path, host='127.0.0.1', port=8590, cache_size=512):
+    queries = ClaimsQueries(load_claims(claims_path), cache_size=cache_size)
+    server = ThreadingHTTPServer((host, port), make_handler(queries))
+    print(f'Serving claims queries on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local claims query service')
+    parser.add_argument('claims', help='cleaned claims csv (claims_v2.csv)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8590)
+    parser.add_argument('--cache-size', type=int, default=512)
+    args = parser.parse_args()
+    serve(args.claims, args.host, args.port, args.cache_size)
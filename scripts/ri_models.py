@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recurrence interval (RI) models from curve_fit.py, batched over many series.
+
+A series is one row of annual damages (e.g. one hazard/county of the claims
+cube). Years without claims are 0 in the cube and, like the groupby in
+curve_fit.py, they are left out of the ranking.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Log 10 fits much better than numpy's ln() default
+def log_func(x, a, b):
+    return a * np.log10(x) + b
+
+
+def calc_ri_matrix(values, years):
+    """
+    calc_ri() for every row of a series x years array.
+
+    RI = (record_yrs + 1) / rank with ranks in descending order, where
+    record_yrs spans the first to last year with claims in that row.
+    Returns an array of RIs with NaN where a year had no claims.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    years = np.asarray(years)
+    observed = values > 0
+
+    rank = pd.DataFrame(np.where(observed, values, np.nan)).rank(
+        axis=1, ascending=False
+    ).to_numpy()
+    rank = np.floor(rank)
+
+    year_grid = np.broadcast_to(years, values.shape)
+    first = np.where(observed, year_grid, np.iinfo(np.int64).max).min(axis=1)
+    last = np.where(observed, year_grid, np.iinfo(np.int64).min).max(axis=1)
+    record_yrs = (last - first).astype(float)
+
+    with np.errstate(invalid='ignore'):
+        return (record_yrs[:, None] + 1) / rank
+
+
+def fit_log_params(ri, values, min_points=3):
+    """
+    Least squares fit of log_func for every row at once.
+
+    log_func is linear in (a, b), so this is the same fit curve_fit finds in
+    ri_model_fitting() but in closed form. Returns an (n_series, 2) array of
+    (a, b), NaN for rows with fewer than min_points observed years.
+    """
+    ri = np.atleast_2d(np.asarray(ri, dtype=float))
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    mask = np.isfinite(ri) & np.isfinite(values)
+    n = mask.sum(axis=1)
+
+    x = np.where(mask, np.log10(np.where(mask, ri, 1.0)), 0.0)
+    y = np.where(mask, values, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = x.sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dx = np.where(mask, x - x_mean[:, None], 0.0)
+        dy = np.where(mask, y - y_mean[:, None], 0.0)
+        a = (dx * dy).sum(axis=1) / (dx ** 2).sum(axis=1)
+    b = y_mean - a * x_mean
+
+    params = np.column_stack([a, b])
+    params[n < min_points] = np.nan
+    return params
+
+
+def fit_cube(cube, min_points=3):
+    # One (a, b) per hazard/county series of a claims_data.ClaimsCube
+    n_hazards, n_counties, n_years = cube.values.shape
+    values = cube.values.reshape(-1, n_years)
+    ri = calc_ri_matrix(values, cube.years)
+    params = fit_log_params(ri, np.where(np.isfinite(ri), values, np.nan), min_points)
+
+    index = pd.MultiIndex.from_product(
+        [cube.hazards, cube.counties], names=['hazard_broad', 'County_FIPS']
+    )
+    return pd.DataFrame(params, index=index, columns=['a', 'b'])
+
+
+def modeled_ri(value, params):
+    # Inverse of log_func, the RI at which annual damages reach `value`
+    params = np.atleast_2d(params)
+    return 10 ** ((value - params[:, 1]) / params[:, 0])
+
+
+def poisson_grid(params, thresholds, horizon=100, k_max=49):
+    """
+    Poisson probabilities of k exceedances per `horizon` years for each damage
+    threshold, the same table as the Poisson cells of curve_fit.py.
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    lambdas = horizon / np.array([modeled_ri(t, params)[0] for t in thresholds])
+
+    k = np.arange(1, k_max + 1)
+    log_factorial = np.cumsum(np.log(k))
+    P = np.exp(k * np.log(lambdas[:, None]) - lambdas[:, None] - log_factorial)
+
+    return pd.DataFrame({
+        'threshold': np.repeat(thresholds, k.size),
+        'Lambda': np.repeat(lambdas, k.size),
+        'k': np.tile(k, thresholds.size),
+        'P': P.ravel(),
+    })
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rolling-window statistics along the year axis of every claims series.
+
+Totals, means, exceedance counts and OLS trend slopes for N-year windows
+all come from running (cumulative) sums, so every window length and every
+series is done in one vectorized pass instead of refiltering the claims
+per window. Appending a year only extends the running sums.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_WINDOWS = (5, 10, 20)
+
+
+class RollingTrends:
+    """
+    Running sums of a (..., n_years) array, e.g. ClaimsCube.values.
+
+    threshold is the exceedance level, a scalar or an array broadcasting
+    against values[..., 0] (e.g. one threshold per series).
+    """
+
+    def __init__(self, values, years, windows=DEFAULT_WINDOWS, threshold=None):
+        values = np.asarray(values, dtype=float)
+        self.windows = tuple(windows)
+        self.threshold = None if threshold is None else np.asarray(threshold, dtype=float)
+        self.shape = values.shape[:-1]
+        self.years = np.asarray(years).tolist()
+
+        # Running sums of x, j * x and (x > threshold), with a leading 0 so
+        # the sum over years [a, b) is s[b] - s[a]
+        capacity = max(2 * len(self.years), 16) + 1
+        self._sums = np.zeros((3,) + self.shape + (capacity,))
+        self._n = 0
+        self._extend(values)
+
+    def _extend(self, values):
+        n_new = values.shape[-1]
+        if self._n + n_new + 1 > self._sums.shape[-1]:
+            grown = np.zeros(self._sums.shape[:-1] + (2 * (self._n + n_new) + 1,))
+            grown[..., :self._n + 1] = self._sums[..., :self._n + 1]
+            self._sums = grown
+
+        j = np.arange(self._n, self._n + n_new)
+        if self.threshold is None:
+            exceed = np.zeros_like(values)
+        else:
+            exceed = values > self.threshold[..., None]
+        steps = np.stack([values, j * values, exceed])
+        last = self._sums[..., self._n:self._n + 1]
+        self._sums[..., self._n + 1:self._n + n_new + 1] = last + np.cumsum(steps, axis=-1)
+        self._n += n_new
+
+    def append(self, year, values):
+        """
+        Add one year (values shaped like values[..., 0]) and return the
+        stats of the windows ending in that year.
+        """
+        self.years.append(year)
+        self._extend(np.asarray(values, dtype=float)[..., None])
+        return {w: self._window(w, self._n - w, self._n) for w in self.windows if w <= self._n}
+
+    def _window(self, w, first, stop):
+        # Stats of the windows starting at years first..stop-w, vectorized
+        s = self._sums[..., :self._n + 1]
+        total = s[0, ..., first + w:stop + 1] - s[0, ..., first:stop - w + 1]
+        jx = s[1, ..., first + w:stop + 1] - s[1, ..., first:stop - w + 1]
+        exceed = s[2, ..., first + w:stop + 1] - s[2, ..., first:stop - w + 1]
+
+        # Slope against t = 0..w-1 within each window:
+        # (w * sum(t x) - sum(t) * sum(x)) / (w * sum(t^2) - sum(t)^2)
+        start = np.arange(first, stop - w + 1)
+        tx = jx - start * total
+        denom = w * w * (w * w - 1) / 12
+        slope = (w * tx - w * (w - 1) / 2 * total) / denom if w > 1 else np.zeros_like(total)
+
+        out = {'total': total, 'mean': total / w, 'slope': slope}
+        if self.threshold is not None:
+            out['exceed'] = exceed
+        return out
+
+    def stats(self):
+        """
+        Every window of every length: {w: {stat: (..., n_years - w + 1)}},
+        labelled by window_end_years(w).
+        """
+        return {w: self._window(w, 0, self._n) for w in self.windows if w <= self._n}
+
+    def window_end_years(self, w):
+        return self.years[w - 1:]
+
+
+def rolling_stats(values, years, windows=DEFAULT_WINDOWS, threshold=None):
+    # One-shot version of RollingTrends(...).stats()
+    return RollingTrends(values, years, windows, threshold).stats()
+
+
+def rolling_frame(trends, cube):
+    """
+    Long table (hazard, county, window, end year, stats) of a RollingTrends
+    built on a claims_data.ClaimsCube.
+    """
+    frames = []
+    for w, stats in trends.stats().items():
+        end_years = trends.window_end_years(w)
+        index = pd.MultiIndex.from_product(
+            [cube.hazards, cube.counties, end_years],
+            names=['hazard_broad', 'County_FIPS', 'end_year']
+        )
+        frame = pd.DataFrame({k: v.ravel() for k, v in stats.items()}, index=index)
+        frame.insert(0, 'window', w)
+        frames.append(frame)
+    return pd.concat(frames).reset_index()